@@ -68,13 +68,15 @@ chain.invoke("What is Task Decomposition?")
 ```
 """
 
-import hashlib
-import json
+import functools
+import os
 import sys
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple, cast, get_args
 
+import blake3
 import dotenv
+import numpy as np
 from langchain.vectorstores.chroma import Chroma
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.llms.huggingface_pipeline import HuggingFacePipeline
@@ -130,24 +132,127 @@ def get_hf_embeddings_model(name: str) -> HuggingFaceEmbeddings:
     except ImportError as e:
         raise HFImportError() from e
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    encode_kwargs = {"normalize_embeddings": True}
+    encode_kwargs = {"normalize_embeddings": True, "batch_size": 256}
     mode_kwargs = {"device": device}
-    return HuggingFaceEmbeddings(
+    embeddings_model = HuggingFaceEmbeddings(
         model_name=name, encode_kwargs=encode_kwargs, model_kwargs=mode_kwargs
     )
+    if device.type == "cuda":
+        # Half precision halves memory traffic and runs on tensor cores.
+        embeddings_model.client.half()
+    return embeddings_model
 
 
-def get_embeddings_model(name: str, model_type: ModelType) -> Embeddings:
+class TruncatedEmbeddings(Embeddings):
+    """
+    Embeddings model projecting embeddings of the wrapped model onto their
+    first `dimensions` principal components.
+
+    The projection should be fitted on document embeddings before indexing
+    (s. `fit`) and stored alongside the vectorstore collection (s. `save`,
+    `load` and `get_filepath`).
+    """
+
+    def __init__(self, embeddings_model: Embeddings, dimensions: int) -> None:
+        self.embeddings_model = embeddings_model
+        self.dimensions = dimensions
+        self.mean: Optional[np.ndarray] = None
+        self.components: Optional[np.ndarray] = None
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.components is not None
+
+    def copy(self) -> "TruncatedEmbeddings":
+        """
+        Copy sharing the wrapped model, whose projection can be fitted or
+        loaded independently.
+        """
+        embeddings_model = TruncatedEmbeddings(self.embeddings_model, self.dimensions)
+        embeddings_model.mean, embeddings_model.components = self.mean, self.components
+        return embeddings_model
+
+    @staticmethod
+    def get_filepath(persist_directory: Path, collection_name: str) -> Path:
+        return persist_directory / f"{collection_name}-projection.npz"
+
+    def fit(self, embeddings: np.ndarray) -> None:
+        """
+        Fit the projection on document embeddings of the wrapped model.
+        """
+        try:
+            from sklearn.decomposition import IncrementalPCA
+        except ImportError as e:
+            raise ImportError(
+                "Install scikit-learn to reduce dimensionality of Hugging Face "
+                "embeddings: `pip install renumics-rag[hf]` or `pip install scikit-learn`."
+            ) from e
+        if len(embeddings) < self.dimensions:
+            raise ValueError(
+                f"At least {self.dimensions} embeddings required to fit the "
+                f"projection, but {len(embeddings)} received."
+            )
+        pca = IncrementalPCA(n_components=self.dimensions).fit(embeddings)
+        self.mean = pca.mean_.astype(np.float32)
+        self.components = pca.components_.astype(np.float32)
+
+    def save(self, filepath: Path) -> None:
+        assert self.mean is not None and self.components is not None
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(filepath, mean=self.mean, components=self.components)
+
+    def load(self, filepath: Path) -> None:
+        with np.load(filepath) as projection:
+            mean, components = projection["mean"], projection["components"]
+        if len(components) != self.dimensions:
+            raise RuntimeError(
+                f"Given embeddings dimensions {self.dimensions} don't match with "
+                f"the dimensions {len(components)} of the projection at "
+                f"'{filepath}'."
+            )
+        self.mean, self.components = mean, components
+
+    def project(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Project embeddings of the wrapped model.
+        """
+        if self.mean is None or self.components is None:
+            raise RuntimeError("Projection of the embeddings model is not fitted.")
+        projected = (embeddings - self.mean) @ self.components.T
+        return projected / np.linalg.norm(projected, axis=-1, keepdims=True)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        embeddings = self.embeddings_model.embed_documents(texts)
+        return self.project(np.asarray(embeddings, dtype=np.float32)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        embedding = self.embeddings_model.embed_query(text)
+        return self.project(np.asarray(embedding, dtype=np.float32)).tolist()
+
+
+@functools.lru_cache(maxsize=1)
+def get_embeddings_model(
+    name: str, model_type: ModelType, dimensions: Optional[int] = None
+) -> Embeddings:
+    """
+    If `dimensions` is given, OpenAI models return shortened embeddings and
+    Hugging Face models are wrapped into `TruncatedEmbeddings`.
+    """
     if model_type == "azure":
-        return AzureOpenAIEmbeddings(azure_deployment=name)
+        return AzureOpenAIEmbeddings(azure_deployment=name, dimensions=dimensions)
     if model_type == "openai":
-        return OpenAIEmbeddings(model=name)
+        return OpenAIEmbeddings(model=name, dimensions=dimensions)
     if model_type == "hf":
-        return get_hf_embeddings_model(name)
+        embeddings_model = get_hf_embeddings_model(name)
+        if dimensions is None:
+            return embeddings_model
+        return TruncatedEmbeddings(embeddings_model, dimensions)
     raise TypeError(f"Unknown model type '{model_type}'.")
 
 
 def get_embeddings_model_config(embeddings_model: Embeddings) -> Tuple[str, ModelType]:
+    if isinstance(embeddings_model, TruncatedEmbeddings):
+        return get_embeddings_model_config(embeddings_model.embeddings_model)
     if isinstance(embeddings_model, AzureOpenAIEmbeddings):
         assert embeddings_model.deployment is not None
         return embeddings_model.deployment, "azure"
@@ -158,25 +263,114 @@ def get_embeddings_model_config(embeddings_model: Embeddings) -> Tuple[str, Mode
     raise TypeError(f"Unknown model type `{type(embeddings_model)}`.")
 
 
-def get_hf_llm(name: str) -> HuggingFacePipeline:
+def get_embeddings_model_dimensions(embeddings_model: Embeddings) -> Optional[int]:
+    """
+    Get reduced dimensions of the given embeddings model, if any.
+    """
+    if isinstance(embeddings_model, TruncatedEmbeddings):
+        return embeddings_model.dimensions
+    if isinstance(embeddings_model, OpenAIEmbeddings):
+        return embeddings_model.dimensions
+    return None
+
+
+def get_hf_onnx_pipeline(name: str, **kwargs: Any) -> Any:
+    """
+    Export Hugging Face model to ONNX and create a pipeline running it with
+    ONNX Runtime.
+    """
+    try:
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForCausalLM, ORTModelForSeq2SeqLM
+        from transformers import AutoConfig, AutoTokenizer, pipeline
+    except ImportError as e:
+        raise ImportError(
+            "Install Optimum with ONNX Runtime to run Hugging Face LLMs with ONNX "
+            "Runtime: `pip install renumics-rag[onnx]` or "
+            "`pip install optimum[onnxruntime-gpu]`."
+        ) from e
+    if AutoConfig.from_pretrained(name).is_encoder_decoder:
+        task, model_cls = "text2text-generation", ORTModelForSeq2SeqLM
+    else:
+        task, model_cls = "text-generation", ORTModelForCausalLM
+    # `torch.cuda.is_available()` says nothing about the installed ONNX Runtime
+    # build (`onnxruntime` vs. `onnxruntime-gpu`), so ask ONNX Runtime itself.
+    # The model is exported in fp32 even on GPU: fp16 export needs the model on
+    # CUDA at export time and a saved export directory, and the exported fp16
+    # decoders are not numerically stable for all architectures.
+    if "CUDAExecutionProvider" in onnxruntime.get_available_providers():
+        provider = "CUDAExecutionProvider"
+    else:
+        provider = "CPUExecutionProvider"
+    model = model_cls.from_pretrained(name, export=True, provider=provider)
+    tokenizer = AutoTokenizer.from_pretrained(name)
+    return pipeline(task, model=model, tokenizer=tokenizer, **kwargs)
+
+
+def get_hf_llm(name: str, use_onnx: bool = False) -> HuggingFacePipeline:
     try:
         import torch
-        from transformers import pipeline
+        from transformers import BitsAndBytesConfig, pipeline
+        from transformers.utils import is_flash_attn_2_available
     except ImportError as e:
         raise HFImportError() from e
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    pipe = pipeline(model=name, device=device, max_length=2048)
-    llm = HuggingFacePipeline(pipeline=pipe)
-    return llm
-
-
-def get_llm(name: str, model_type: ModelType) -> LLM:
+    # Greedy decoding, limit only generated tokens regardless of prompt length.
+    kwargs: Dict[str, Any] = {"max_new_tokens": 256, "do_sample": False}
+    if use_onnx:
+        return _get_hf_pipeline_llm(get_hf_onnx_pipeline(name, **kwargs))
+    model_kwargs: Dict[str, Any] = {}
+    if torch.cuda.is_available():
+        # Quantize weights to 4-bit NormalFloat, bitsandbytes requires CUDA.
+        compute_dtype = (
+            torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        )
+        kwargs["device_map"] = "auto"
+        model_kwargs["torch_dtype"] = compute_dtype
+        model_kwargs["quantization_config"] = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=compute_dtype,
+            bnb_4bit_use_double_quant=True,
+        )
+        if is_flash_attn_2_available():
+            model_kwargs["attn_implementation"] = "flash_attention_2"
+    else:
+        kwargs["device"] = torch.device("cpu")
+    kwargs["model_kwargs"] = model_kwargs
+    try:
+        pipe = pipeline(model=name, **kwargs)
+    except ValueError:
+        if "attn_implementation" not in model_kwargs:
+            raise
+        # Model architecture doesn't support Flash Attention 2.
+        del model_kwargs["attn_implementation"]
+        pipe = pipeline(model=name, **kwargs)
+    return _get_hf_pipeline_llm(pipe)
+
+
+def _get_hf_pipeline_llm(pipe: Any) -> HuggingFacePipeline:
+    # Decoder-only models often have no pad token, and `generate` then warns
+    # and sets it to EOS on every call.
+    if (
+        pipe.task == "text-generation"
+        and pipe.model.generation_config.pad_token_id is None
+    ):
+        pipe.model.generation_config.pad_token_id = pipe.tokenizer.eos_token_id
+    return HuggingFacePipeline(pipeline=pipe)
+
+
+# LLMs can occupy most of the GPU memory, so keep only the latest one.
+@functools.lru_cache(maxsize=1)
+def get_llm(name: str, model_type: ModelType, use_onnx: bool = False) -> LLM:
+    """
+    `use_onnx` only applies to Hugging Face models, s. `get_hf_llm`.
+    """
     if model_type == "azure":
         return AzureChatOpenAI(azure_deployment=name, temperature=0.0)
     if model_type == "openai":
         return ChatOpenAI(model=name, temperature=0.0)
     if model_type == "hf":
-        return get_hf_llm(name)
+        return get_hf_llm(name, use_onnx)
     raise TypeError(f"Unknown model type '{model_type}'.")
 
 
@@ -202,6 +396,7 @@ def assert_embeddings_model_ok_for_chromadb(
         # Vectorstore doesn't exist yet.
         return
     model_name, model_type = get_embeddings_model_config(embeddings_model)
+    model_dimensions = get_embeddings_model_dimensions(embeddings_model)
     client_settings = chromadb.Settings(
         is_persistent=True, persist_directory=str(persist_directory)
     )
@@ -242,6 +437,43 @@ def assert_embeddings_model_ok_for_chromadb(
                 f"'{collection_model_name}' of the "
                 f"collection '{collection_name}' of the database."
             )
+    try:
+        collection_model_dimensions = collection.metadata["model_dimensions"]
+    except KeyError:
+        ...  # No model dimensions in the metadata.
+    else:
+        if collection_model_dimensions != model_dimensions:
+            raise RuntimeError(
+                f"Given embeddings dimensions '{model_dimensions}' don't "
+                f"match with the embeddings dimensions "
+                f"'{collection_model_dimensions}' of the "
+                f"collection '{collection_name}' of the database."
+            )
+
+
+def get_collection_embeddings_model(
+    embeddings_model: Embeddings,
+    persist_directory: Optional[Path],
+    collection_name: str,
+) -> Embeddings:
+    """
+    Embeddings model to use with the given collection of the given ChromaDB.
+
+    Embeddings models are shared (s. `get_embeddings_model`), so every
+    collection gets its own copy of a `TruncatedEmbeddings` model, with the
+    projection fitted while indexing the collection or, if none exists, the
+    projection of the given model.
+    """
+    if not isinstance(embeddings_model, TruncatedEmbeddings):
+        return embeddings_model
+    embeddings_model = embeddings_model.copy()
+    if persist_directory is not None:
+        projection_filepath = TruncatedEmbeddings.get_filepath(
+            persist_directory, collection_name
+        )
+        if projection_filepath.is_file():
+            embeddings_model.load(projection_filepath)
+    return embeddings_model
 
 
 def get_chromadb(
@@ -249,14 +481,24 @@ def get_chromadb(
     persist_directory: Optional[Path] = None,
     collection_name: str = Chroma._LANGCHAIN_DEFAULT_COLLECTION_NAME,
     relevance_score_fn: RelevanceScoreFn = "l2",
+    hnsw_m: int = 32,
+    hnsw_ef_construction: int = 200,
+    hnsw_ef_search: int = 100,
 ) -> Chroma:
     """
     https://docs.trychroma.com/usage-guide#changing-the-distance-function
+
+    `hnsw_m` and `hnsw_ef_construction` only take effect when the collection
+    is created.
     """
     if embeddings_model is not None and persist_directory is not None:
         assert_embeddings_model_ok_for_chromadb(
             embeddings_model, persist_directory, collection_name
         )
+    if embeddings_model is not None:
+        embeddings_model = get_collection_embeddings_model(
+            embeddings_model, persist_directory, collection_name
+        )
 
     kwargs: Dict = {
         "collection_name": collection_name,
@@ -265,11 +507,22 @@ def get_chromadb(
             None if persist_directory is None else str(persist_directory)
         ),
     }
-    collection_metadata = {}
+    collection_metadata: Dict[str, Any] = {
+        "hnsw:M": hnsw_m,
+        "hnsw:construction_ef": hnsw_ef_construction,
+        "hnsw:search_ef": hnsw_ef_search,
+        "hnsw:num_threads": os.cpu_count() or 1,
+        # Fewer, larger writes of the HNSW index during indexing.
+        "hnsw:batch_size": 1000,
+        "hnsw:sync_threshold": 10000,
+    }
     if embeddings_model is not None:
         model_name, model_type = get_embeddings_model_config(embeddings_model)
         collection_metadata["model_name"] = model_name
         collection_metadata["model_type"] = model_type
+        model_dimensions = get_embeddings_model_dimensions(embeddings_model)
+        if model_dimensions is not None:
+            collection_metadata["model_dimensions"] = model_dimensions
 
     if isinstance(relevance_score_fn, str):
         assert relevance_score_fn in get_args(PredefinedRelevanceScoreFn)
@@ -304,16 +557,28 @@ def get_retriever(
     return vectorstore.as_retriever(**kwargs)
 
 
+def _doc_parts(doc: Document) -> Tuple[str, ...]:
+    return ("Content: ", doc.page_content, '\nSource: "', doc.metadata["source"], '"')
+
+
 def format_doc(doc: Document) -> str:
-    return f"Content: {doc.page_content}\nSource: \"{doc.metadata['source']}\""
+    return "".join(_doc_parts(doc))
 
 
 def format_docs(docs: List[Document]) -> str:
-    return "\n\n".join(map(format_doc, docs))
+    parts: List[str] = []
+    for doc in docs:
+        if parts:
+            parts.append("\n\n")
+        parts.extend(_doc_parts(doc))
+    return "".join(parts)
 
 
-def get_rag_chain(retriever: VectorStoreRetriever, llm: LLM) -> Runnable:
-    template = """You are an assistant for question-answering tasks.
+def _format_source_documents(inputs: Dict[str, Any]) -> str:
+    return format_docs(inputs["source_documents"])
+
+
+_RAG_TEMPLATE = """You are an assistant for question-answering tasks.
 Given the following extracted parts of a long document and a question, create a final answer with references ("SOURCES").
 If you don't know the answer, just say that you don't know. Don't try to make up an answer.
 ALWAYS return a "SOURCES" part in your answer.
@@ -323,29 +588,34 @@ QUESTION: {question}
 {source_documents}
 =========
 FINAL ANSWER: """
-    prompt = ChatPromptTemplate.from_template(template)
+_RAG_PROMPT = ChatPromptTemplate.from_template(_RAG_TEMPLATE)
+
+
+def get_rag_chain(retriever: VectorStoreRetriever, llm: LLM) -> Runnable:
     rag_chain_from_docs = (
-        RunnablePassthrough.assign(
-            source_documents=(lambda x: format_docs(x["source_documents"]))
-        )
-        | prompt
+        RunnablePassthrough.assign(source_documents=_format_source_documents)
+        | _RAG_PROMPT
         | llm
         | StrOutputParser()
     )
     rag_chain_with_source = RunnableParallel(
         {  # type: ignore
-            "source_documents": retriever,
+            "source_documents": retriever.with_config(run_name="retrieve"),
             "question": RunnablePassthrough(),
         }
     ).assign(answer=rag_chain_from_docs)
     return rag_chain_with_source
 
 
+def _serialize_doc(doc: Document) -> bytes:
+    return f"{doc.metadata['source']}\0{doc.page_content}".encode()
+
+
 def stable_hash(doc: Document) -> str:
     """
-    Stable hash document based on its metadata.
+    Stable hash document based on its source and content.
     """
-    return hashlib.sha1(json.dumps(doc.metadata, sort_keys=True).encode()).hexdigest()
+    return blake3.blake3(_serialize_doc(doc)).hexdigest(length=20)
 
 
 def question_as_doc(question: str, rag_answer: Dict[str, Any]) -> Document:
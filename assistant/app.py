@@ -16,7 +16,9 @@ from langchain_openai import (
 )
 
 from assistant import (
+    TruncatedEmbeddings,
     get_chromadb,
+    get_collection_embeddings_model,
     get_embeddings_model,
     get_embeddings_model_config,
     get_llm,
@@ -56,6 +58,7 @@ HASH_FUNCS: Dict[Union[str, Type], Callable[[Any], Any]] = {
     AzureOpenAIEmbeddings: hash_model,
     OpenAIEmbeddings: hash_model,
     HuggingFaceEmbeddings: hash_model,
+    TruncatedEmbeddings: hash_model,
     AzureChatOpenAI: hash_model,
     ChatOpenAI: hash_model,
     HuggingFacePipeline: hash_model,
@@ -63,9 +66,18 @@ HASH_FUNCS: Dict[Union[str, Type], Callable[[Any], Any]] = {
 
 
 _get_llm = st.cache_resource(max_entries=1, show_spinner=False)(get_llm)
-_get_embeddings_model = st.cache_resource(max_entries=1, show_spinner=False)(
-    get_embeddings_model
-)
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _get_embeddings_model(
+    name: str, model_type: ModelType, dimensions: Optional[int] = None
+) -> Embeddings:
+    # Questions are embedded with the projection of the docs collection.
+    return get_collection_embeddings_model(
+        get_embeddings_model(name, model_type, dimensions),
+        settings.docs_db_directory,
+        settings.docs_db_collection,
+    )
 
 
 @st.cache_resource(show_spinner=False, hash_funcs=HASH_FUNCS)
@@ -280,8 +292,13 @@ def st_app(
         embeddings_model = _get_embeddings_model(
             st.session_state.embeddings_model_name,
             st.session_state.embeddings_model_type,
+            settings.embeddings_dimensions,
+        )
+        llm = _get_llm(
+            st.session_state.llm_name,
+            st.session_state.llm_type,
+            settings.llm_use_onnx,
         )
-        llm = _get_llm(st.session_state.llm_name, st.session_state.llm_type)
         chain = _get_rag_chain(
             llm,
             st.session_state.relevance_score_fn,
@@ -1,24 +1,49 @@
 #!/usr/bin/env python3
-from typing import List
+import asyncio
+import sys
+from typing import Any, AsyncIterator, List, Tuple
 
 import typer
+from langchain_core.runnables import Runnable
 from typing_extensions import Annotated
 
 from assistant import (
     get_chromadb,
+    get_collection_embeddings_model,
     get_embeddings_model,
     get_llm,
+    get_llm_config,
     get_rag_chain,
     get_retriever,
     parse_model_name,
     question_as_doc,
 )
-from assistant.const import EMBEDDINGS_MODEL_NAME_HELP, LLM_NAME_HELP
+from assistant.const import EMBEDDINGS_MODEL_NAME_HELP, LLM_NAME_HELP, MAX_CONCURRENCY
 from assistant.settings import settings
 
 app = typer.Typer()
 
 
+async def aanswer_questions(
+    rag_chain: Runnable, questions: List[str], max_concurrency: int
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Answer questions with up to `max_concurrency` of them in flight and yield
+    each question with its answer (or exception) as soon as it is answered.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def aanswer_question(question: str) -> Tuple[str, Any]:
+        async with semaphore:
+            try:
+                return question, await rag_chain.ainvoke(question)
+            except Exception as e:
+                return question, e
+
+    for future in asyncio.as_completed(map(aanswer_question, questions)):
+        yield await future
+
+
 @app.command()
 def answer(
     questions: Annotated[List[str], typer.Argument(help="Question(s) to answer.")],
@@ -32,8 +57,15 @@ def answer(
     """
     Answer question(s) using indexed database.
     """
-    embeddings_model = get_embeddings_model(*parse_model_name(embeddings_model_name))
-    llm = get_llm(*parse_model_name(llm_name))
+    # Questions are embedded with the projection of the docs collection.
+    embeddings_model = get_collection_embeddings_model(
+        get_embeddings_model(
+            *parse_model_name(embeddings_model_name), settings.embeddings_dimensions
+        ),
+        settings.docs_db_directory,
+        settings.docs_db_collection,
+    )
+    llm = get_llm(*parse_model_name(llm_name), settings.llm_use_onnx)
     docs_vectorstore = get_chromadb(
         embeddings_model,
         settings.docs_db_directory,
@@ -57,20 +89,39 @@ def answer(
         settings.questions_db_collection,
     )
 
-    for question in questions:
-        print(f"QUESTION: {question}")
-        rag_answer = rag_chain.invoke(question)
+    # Answer questions concurrently, but a local LLM one at a time. Answers are
+    # stored and printed as they come, a failed question (e.g. rate limit)
+    # doesn't discard the answers to the others.
+    _, llm_type = get_llm_config(llm)
 
-        questions_vectorstore.add_documents([question_as_doc(question, rag_answer)])
+    async def aanswer() -> bool:
+        failed = False
+        async for question, result in aanswer_questions(
+            rag_chain, questions, 1 if llm_type == "hf" else MAX_CONCURRENCY
+        ):
+            if isinstance(result, Exception):
+                print(
+                    f"Failed to answer question '{question}': {result}",
+                    file=sys.stderr,
+                )
+                failed = True
+                continue
+            questions_vectorstore.add_documents([question_as_doc(question, result)])
+            print(f"QUESTION: {question}")
+            print(f"ANSWER: {result['answer']}")
+            print("SOURCES:")
+            for doc in result["source_documents"]:
+                print(f"CONTENT: {doc.page_content}")
+                print(
+                    "METADATA: "
+                    + ", ".join(
+                        f"{key}: {value}" for key, value in doc.metadata.items()
+                    )
+                )
+        return not failed
 
-        print(f"ANSWER: {rag_answer['answer']}")
-        print("SOURCES:")
-        for doc in rag_answer["source_documents"]:
-            print(f"CONTENT: {doc.page_content}")
-            print(
-                "METADATA: "
-                + ", ".join(f"{key}: {value}" for key, value in doc.metadata.items())
-            )
+    if not asyncio.run(aanswer()):
+        raise typer.Exit(1)
 
 
 if __name__ == "__main__":
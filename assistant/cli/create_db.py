@@ -1,27 +1,135 @@
 #!/usr/bin/env python3
-import math
+import asyncio
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from enum import Enum
 from pathlib import Path
+from typing import Dict, List, Optional
 
 import chromadb
 import chromadb.config
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import typer
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.vectorstores.chroma import Chroma
 from langchain_community.document_loaders import (
     BSHTMLLoader,
     DirectoryLoader,
     PyPDFLoader,
     UnstructuredMarkdownLoader,
 )
-from tqdm import trange
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from semantic_text_splitter import TextSplitter
+from tqdm import tqdm
+from tqdm.asyncio import tqdm_asyncio
 from typing_extensions import Annotated
 
-from assistant import get_chromadb, get_embeddings_model, parse_model_name, stable_hash
-from assistant.const import EMBEDDINGS_MODEL_NAME_HELP
+from assistant import (
+    TruncatedEmbeddings,
+    get_chromadb,
+    get_collection_embeddings_model,
+    get_embeddings_model,
+    get_embeddings_model_config,
+    parse_model_name,
+    stable_hash,
+)
+from assistant.const import (
+    EMBEDDINGS_DIMENSIONS_HELP,
+    EMBEDDINGS_MODEL_NAME_HELP,
+    MAX_CONCURRENCY,
+)
 from assistant.settings import settings
 
 app = typer.Typer()
 
+# Amount of document chunks to fit reduction of embeddings dimensionality on.
+PROJECTION_FIT_SIZE = 5000
+
+
+def _load_html(filepath: str) -> List[Document]:
+    return BSHTMLLoader(filepath, open_encoding="utf-8").load()
+
+
+def load_html_docs(docs_directory: Path) -> List[Document]:
+    """
+    Load all visible HTML documents in the given directory recursively.
+
+    HTML parsing is CPU-bound, so documents are parsed in a process pool.
+    """
+    filepaths = [
+        str(filepath)
+        for filepath in sorted(docs_directory.rglob("*.html"))
+        if filepath.is_file()
+        and not any(
+            part.startswith(".") for part in filepath.relative_to(docs_directory).parts
+        )
+    ]
+    docs_per_file: List[List[Document]] = [[] for _ in filepaths]
+    with ProcessPoolExecutor() as executor:
+        futures = {
+            executor.submit(_load_html, filepath): index
+            for index, filepath in enumerate(filepaths)
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            docs_per_file[futures[future]] = future.result()
+    return [doc for docs in docs_per_file for doc in docs]
+
+
+def split_docs(docs: List[Document]) -> List[Document]:
+    """
+    Split documents into chunks of up to 1000 characters overlapping by up to
+    200 characters, and store chunk offsets as `start_index` metadata.
+    """
+    text_splitter = TextSplitter(1000, overlap=200)
+    return [
+        Document(
+            page_content=chunk, metadata={**doc.metadata, "start_index": start_index}
+        )
+        for doc in docs
+        for start_index, chunk in text_splitter.chunk_indices(doc.page_content)
+    ]
+
+
+def upsert_splits(
+    vectorstore: Chroma,
+    ids: List[str],
+    splits: List[Document],
+    embeddings: List[List[float]],
+) -> None:
+    vectorstore._collection.upsert(
+        ids=ids,
+        embeddings=embeddings,  # type: ignore
+        metadatas=[split.metadata for split in splits],  # type: ignore
+        documents=[split.page_content for split in splits],
+    )
+
+
+async def aindex_splits(
+    vectorstore: Chroma,
+    embeddings_model: Embeddings,
+    ids: List[str],
+    splits: List[Document],
+    batch_size: int,
+    max_concurrency: int,
+) -> None:
+    """
+    Embed and upsert document chunks batch by batch, with up to
+    `max_concurrency` batches in flight.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def aindex_batch(start: int) -> None:
+        end = start + batch_size
+        async with semaphore:
+            embeddings = await embeddings_model.aembed_documents(
+                [split.page_content for split in splits[start:end]]
+            )
+            upsert_splits(vectorstore, ids[start:end], splits[start:end], embeddings)
+
+    await tqdm_asyncio.gather(*map(aindex_batch, range(0, len(splits), batch_size)))
+
 
 class OnMatchAction(str, Enum):
     IGNORE = "ignore"
@@ -40,6 +148,10 @@ def create_db(
     embeddings_model_name: Annotated[
         str, typer.Option("--embeddings", help=EMBEDDINGS_MODEL_NAME_HELP)
     ] = settings.full_embeddings_model_name,
+    embeddings_dimensions: Annotated[
+        Optional[int],
+        typer.Option("--dimensions", min=1, help=EMBEDDINGS_DIMENSIONS_HELP),
+    ] = settings.embeddings_dimensions,
     exist_ok: Annotated[
         bool,
         typer.Option(
@@ -55,11 +167,31 @@ def create_db(
     ] = OnMatchAction.FAIL,
     batch_size: Annotated[
         int, typer.Option(help="Batch size for indexing document chunks.")
-    ] = 50,
+    ] = 500,
 ) -> None:
     """
     Index documents into database.
     """
+    # Load documents first: the process pool forks this process, which must not
+    # hold model or database threads yet.
+    docs = load_html_docs(docs_directory)
+    loader = DirectoryLoader(
+        str(docs_directory),
+        glob="*.md",
+        loader_cls=UnstructuredMarkdownLoader,
+        recursive=True,
+        show_progress=True,
+    )
+    docs.extend(loader.load())
+    loader = DirectoryLoader(
+        str(docs_directory),
+        glob="*.pdf",
+        loader_cls=PyPDFLoader,  # type: ignore
+        recursive=True,
+        show_progress=True,
+    )
+    docs.extend(loader.load())
+
     if not exist_ok and settings.docs_db_directory.exists():
         client_settings = chromadb.config.Settings(
             is_persistent=True, persist_directory=str(settings.docs_db_directory)
@@ -72,81 +204,130 @@ def create_db(
                 f"the vectorstore at '{settings.docs_db_directory}'. Set "
                 f"'--exist-ok' for appending to existing collections."
             )
-    embeddings_model = get_embeddings_model(*parse_model_name(embeddings_model_name))
+    embeddings_model = get_collection_embeddings_model(
+        get_embeddings_model(
+            *parse_model_name(embeddings_model_name), embeddings_dimensions
+        ),
+        settings.docs_db_directory,
+        settings.docs_db_collection,
+    )
     assert batch_size > 0
 
     docs_vectorstore = get_chromadb(
         embeddings_model, settings.docs_db_directory, settings.docs_db_collection
     )
-    indexed_doc_filepaths = sorted(
-        set(
-            metadata["source"]
-            for metadata in docs_vectorstore.get(include=["metadatas"])["metadatas"]
-        )
+    response = docs_vectorstore.get(include=["metadatas"])
+    indexed_ids = pa.array(response["ids"], pa.string())
+    indexed_doc_filepaths = pa.array(
+        [metadata["source"] for metadata in response["metadatas"]], pa.string()
     )
 
-    docs = []
-    loader = DirectoryLoader(
-        str(docs_directory),
-        glob="*.html",
-        loader_cls=BSHTMLLoader,
-        loader_kwargs={"open_encoding": "utf-8"},
-        recursive=True,
-        show_progress=True,
-    )
-    docs.extend(loader.load())
-    loader = DirectoryLoader(
-        str(docs_directory),
-        glob="*.md",
-        loader_cls=UnstructuredMarkdownLoader,
-        recursive=True,
-        show_progress=True,
-    )
-    docs.extend(loader.load())
-    loader = DirectoryLoader(
-        str(docs_directory),
-        glob="*.pdf",
-        loader_cls=PyPDFLoader,  # type: ignore
-        recursive=True,
-        show_progress=True,
-    )
-    docs.extend(loader.load())
+    doc_filepaths = pa.array([doc.metadata["source"] for doc in docs], pa.string())
+    is_doc_indexed = pc.is_in(doc_filepaths, value_set=indexed_doc_filepaths)
 
+    replaced_ids: List[str] = []
     if on_match == OnMatchAction.IGNORE:
-        docs = [
-            doc for doc in docs if doc.metadata["source"] not in indexed_doc_filepaths
-        ]
+        docs = list(itertools.compress(docs, pc.invert(is_doc_indexed).to_pylist()))
     elif on_match == OnMatchAction.REPLACE:
-        response = docs_vectorstore.get(include=["metadatas"])
-        ids = [
-            id_
-            for id_, metadata in zip(response["ids"], response["metadatas"])
-            if metadata["source"] in {doc.metadata["source"] for doc in docs}
-        ]
-        docs_vectorstore.delete(ids)
+        replaced_ids = pc.filter(
+            indexed_ids, pc.is_in(indexed_doc_filepaths, value_set=doc_filepaths)
+        ).to_pylist()
     else:
-        if doc_filepaths_match := {doc.metadata["source"] for doc in docs}.intersection(
-            set(indexed_doc_filepaths)
-        ):
+        doc_filepaths_match = pc.unique(pc.filter(doc_filepaths, is_doc_indexed))
+        if len(doc_filepaths_match):
             raise RuntimeError(
                 "Some of the given documents are indexed already. Set "
                 "'--on-match ignore' to ignore the already indexed documents or "
                 "'--on-match replace' to index them again. List of the already "
-                "indexed documents: '" + "', '".join(sorted(doc_filepaths_match)) + "'."
+                "indexed documents: '"
+                + "', '".join(sorted(doc_filepaths_match.to_pylist()))
+                + "'."
             )
 
     if docs:
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, chunk_overlap=200, add_start_index=True
-        )
-        splits = text_splitter.split_documents(docs)
+        splits = split_docs(docs)
+        # Chunk ids depend only on source and content, so chunks indexed
+        # already keep their embeddings and only get their metadata updated.
         split_ids = list(map(stable_hash, splits))
+        is_split_indexed = pc.is_in(
+            pa.array(split_ids, pa.string()), value_set=indexed_ids
+        ).to_pylist()
+        indexed_splits: Dict[str, Document] = {}
+        new_splits: Dict[str, Document] = {}
+        for split, split_id, is_indexed in zip(splits, split_ids, is_split_indexed):
+            if is_indexed:
+                indexed_splits.setdefault(split_id, split)
+            else:
+                new_splits.setdefault(split_id, split)
+        splits = list(new_splits.values())
+        split_ids = list(new_splits)
+
+        # Chunks the projection is fitted on are indexed with their embeddings.
+        num_fit_splits = 0
+        if (
+            isinstance(embeddings_model, TruncatedEmbeddings)
+            and not embeddings_model.is_fitted
+        ):
+            if len(indexed_ids):
+                projection_filepath = TruncatedEmbeddings.get_filepath(
+                    settings.docs_db_directory, settings.docs_db_collection
+                )
+                raise RuntimeError(
+                    f"Projection file '{projection_filepath}' of the collection "
+                    f"'{settings.docs_db_collection}' in the vectorstore at "
+                    f"'{settings.docs_db_directory}' is missing."
+                )
+            raw_embeddings = np.asarray(
+                embeddings_model.embeddings_model.embed_documents(
+                    [split.page_content for split in splits[:PROJECTION_FIT_SIZE]]
+                ),
+                dtype=np.float32,
+            )
+            embeddings_model.fit(raw_embeddings)
+            embeddings_model.save(
+                TruncatedEmbeddings.get_filepath(
+                    settings.docs_db_directory, settings.docs_db_collection
+                )
+            )
+            fit_embeddings = embeddings_model.project(raw_embeddings).tolist()
+            num_fit_splits = len(fit_embeddings)
+            for start in range(0, num_fit_splits, batch_size):
+                end = start + batch_size
+                upsert_splits(
+                    docs_vectorstore,
+                    split_ids[start:end],
+                    splits[start:end],
+                    fit_embeddings[start:end],
+                )
 
-        for batch_index in trange(math.ceil(len(splits) / batch_size)):
-            start = batch_size * batch_index
+        # Remote models are I/O-bound, but a local model only gets slower
+        # (and needs more memory) with concurrent batches.
+        _, model_type = get_embeddings_model_config(embeddings_model)
+        asyncio.run(
+            aindex_splits(
+                docs_vectorstore,
+                embeddings_model,
+                split_ids[num_fit_splits:],
+                splits[num_fit_splits:],
+                batch_size,
+                max_concurrency=1 if model_type == "hf" else MAX_CONCURRENCY,
+            )
+        )
+
+        # Outdated chunks are only removed once their replacements are indexed.
+        outdated_ids = [id_ for id_ in replaced_ids if id_ not in indexed_splits]
+        for start in range(0, len(outdated_ids), batch_size):
+            docs_vectorstore._collection.delete(
+                ids=outdated_ids[start : start + batch_size]
+            )
+        kept_ids = list(indexed_splits)
+        kept_metadatas = [split.metadata for split in indexed_splits.values()]
+        for start in range(0, len(kept_ids), batch_size):
             end = start + batch_size
-            docs_vectorstore.add_documents(splits[start:end], ids=split_ids[start:end])
-            docs_vectorstore.persist()
+            docs_vectorstore._collection.update(
+                ids=kept_ids[start:end],
+                metadatas=kept_metadatas[start:end],  # type: ignore
+            )
 
 
 if __name__ == "__main__":
@@ -28,7 +28,9 @@ def retrieve(
     """
     Retrieve documents relevant to question(s) using indexed database.
     """
-    embeddings_model = get_embeddings_model(*parse_model_name(embeddings_model_name))
+    embeddings_model = get_embeddings_model(
+        *parse_model_name(embeddings_model_name), settings.embeddings_dimensions
+    )
     vectorstore = get_chromadb(
         embeddings_model, settings.docs_db_directory, settings.docs_db_collection
     )
@@ -13,6 +13,11 @@ EMBEDDINGS_MODEL_NAME_HELP = (
     + "'), otherwise model type will be inferred based on the set environmant "
     "variables. E.g.: '" + "', '".join(EMBEDDINGS_MODEL_NAMES) + "'"
 )
+EMBEDDINGS_DIMENSIONS_HELP = (
+    "Reduce dimensionality of embeddings. OpenAI models (text-embedding-3 and "
+    "later) shorten embeddings natively, for Hugging Face models a PCA "
+    "projection is fitted while indexing and stored alongside the vectorstore."
+)
 LLM_NAMES = ["openai:gpt-3.5-turbo", "azure:gpt-4", "hf:google/flan-t5-base"]
 LLM_NAME_HELP = (
     "Name of LLM. Prefix the name with one of the model types ('"
@@ -20,3 +25,5 @@ LLM_NAME_HELP = (
     + "'), otherwise model type will be inferred based on the set environmant "
     "variables. E.g.: '" + "', '".join(LLM_NAMES) + "'"
 )
+# Maximum amount of concurrent requests to remote (OpenAI, Azure) models.
+MAX_CONCURRENCY = 16
@@ -22,6 +22,7 @@ class Settings(BaseModel):
 
     llm_type: Optional[ModelType]
     llm_name: Annotated[str, Field(min_length=1)]
+    llm_use_onnx: bool = False
     relevance_score_fn: RelevanceScoreFn = "l2"
     k: PositiveInt = 4
     search_type: RetrieverSearchType = "similarity"
@@ -30,6 +31,7 @@ class Settings(BaseModel):
     lambda_mult: Annotated[float, Field(ge=0.0, le=1.0)] = 0.5
     embeddings_model_type: Optional[ModelType]
     embeddings_model_name: Annotated[str, Field(min_length=1)]
+    embeddings_dimensions: Optional[PositiveInt] = None
 
     docs_db_directory: Path = Path("./db-docs")
     docs_db_collection: Annotated[str, Field(min_length=1)] = "docs_store"